@@ -1,21 +1,29 @@
 import streamlit as st
 import streamlit.elements.image as st_image
-from PIL import Image, ImageChops, ImageDraw
+from PIL import Image
 import io
+import os
 import re
-import zipfile
+import hashlib
+import functools
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 import base64
+import numpy as np
 import fitz  # PyMuPDF
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.enum.text import PP_ALIGN
-from streamlit_drawable_canvas import st_canvas
+
+try:
+    import blake3  # 可选依赖，更快的文件指纹
+except ImportError:
+    blake3 = None
 
 # ==========================================
 # 1. 紧急修复补丁 (防止报错)
 # ==========================================
 if not hasattr(st_image, 'image_to_url'):
     def local_image_to_url(image, width, clamp, channels, output_format, image_id):
+        if isinstance(image, bytes):
+            img_str = base64.b64encode(image).decode()
+            return (f"data:image/{output_format.lower()};base64,{img_str}",)
         buffered = io.BytesIO()
         if output_format.upper() == "JPEG" and image.mode == "RGBA":
             image = image.convert("RGB")
@@ -24,88 +32,312 @@ if not hasattr(st_image, 'image_to_url'):
         return (f"data:image/{output_format.lower()};base64,{img_str}",)
     st_image.image_to_url = local_image_to_url
 
+# 画布背景图每次 rerun 都会重新编码；image_id 里带了图片内容的 md5，按它缓存编码结果。
+# 背景只供画框参考，用 JPEG 比 PNG 编码快、体积也小
+@st.cache_data(max_entries=64, show_spinner=False)
+def encode_canvas_bg(image_id, _image):
+    buffered = io.BytesIO()
+    if _image.mode not in ("RGB", "L"):
+        _image = _image.convert("RGB")
+    _image.save(buffered, format="JPEG", quality=75, optimize=False)
+    return buffered.getvalue()
+
+_image_to_url = getattr(st_image.image_to_url, "__wrapped__", st_image.image_to_url)
+
+def cached_image_to_url(image, width, clamp, channels, output_format, image_id):
+    if isinstance(image, Image.Image) and image_id.startswith("drawable-canvas-bg-"):
+        image, output_format = encode_canvas_bg(image_id, image), "JPEG"
+    return _image_to_url(image, width, clamp, channels, output_format, image_id)
+
+# 脚本每次 rerun 都会执行到这里，记住原函数避免层层包装
+cached_image_to_url.__wrapped__ = _image_to_url
+st_image.image_to_url = cached_image_to_url
+
 # ==========================================
 # 2. 核心功能函数
 # ==========================================
 st.set_page_config(page_title="PDF 瀑布流提取工具", layout="wide", page_icon="📜")
 
+# 页面显示倍率 / 提取时的最高倍率 (约 600 DPI)，矩阵只构造一次
+# 显示只供画框参考，按 1:1 的 PDF 坐标渲染即可；提取时另行高清渲染
+DISPLAY_ZOOM = 1.0
+HD_SCALE = 8.33
+# 按位图原始分辨率提取时的最低倍率 (144 DPI)，与页面显示倍率无关
+MIN_EXTRACT_SCALE = 2.0
+DISPLAY_MAT = fitz.Matrix(DISPLAY_ZOOM, DISPLAY_ZOOM)
+HD_MAT = fitz.Matrix(HD_SCALE, HD_SCALE)
+
+# 提取标题只需要文字和外框，不保留连字；
+# 保留 CID 兜底，缺少 ToUnicode 表的中文字体才不会变成乱码
+WORD_FLAGS = fitz.TEXTFLAGS_WORDS & ~fitz.TEXT_PRESERVE_LIGATURES
+
+_WS_RE = re.compile(r'\s+')
+_BAD_CHARS_RE = re.compile(r'[\\/*?:"<>|]')
+
+@functools.lru_cache(maxsize=1024)
 def sanitize_filename(text):
-    text = re.sub(r'\s+', ' ', text).strip()
-    return re.sub(r'[\\/*?:"<>|]', "_", text)[:50]
-
-def trim_white_borders(pil_image):
-    bg = Image.new(pil_image.mode, pil_image.size, pil_image.getpixel((0,0)))
-    diff = ImageChops.difference(pil_image, bg)
-    diff = ImageChops.add(diff, diff, 2.0, -100)
-    bbox = diff.getbbox()
-    if bbox:
-        return pil_image.crop(bbox)
-    return pil_image
-
-@st.cache_data
-def get_page_image(file_content, page_num, zoom=2.0):
+    text = _WS_RE.sub(' ', text).strip()
+    return _BAD_CHARS_RE.sub("_", text)[:50]
+
+def trim_white_borders(arr, tolerance=100):
+    """裁掉四周的空白边框，返回原数组的切片视图 (不复制像素)"""
+    # 与左上角背景色相差超过 tolerance 的像素视为内容，按行/列投影求边界
+    pixels = arr if arr.ndim == 3 else arr[..., None]
+    bg = pixels[0, 0].astype(np.int16)
+    hi = np.minimum(bg + tolerance, 255).astype(np.uint8)
+    lo = np.maximum(bg - tolerance, 0).astype(np.uint8)
+
+    def is_content(region):
+        return ((region > hi) | (region < lo)).any(axis=-1)
+
+    # 四条边都碰到内容说明没有可裁的边框，只看边缘像素就能直接返回
+    if (is_content(pixels[:, 0]).any() and is_content(pixels[:, -1]).any()
+            and is_content(pixels[0]).any() and is_content(pixels[-1]).any()):
+        return arr
+    mask = is_content(pixels)
+    rows = mask.any(axis=1)
+    if not rows.any():
+        return arr
+    cols = mask.any(axis=0)
+    y0, y1 = rows.argmax(), len(rows) - rows[::-1].argmax()
+    x0, x1 = cols.argmax(), len(cols) - cols[::-1].argmax()
+    return arr[y0:y1, x0:x1]
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def file_fingerprint(file_content):
+    """文件内容指纹，作为各级缓存的 key"""
+    if blake3 is not None:
+        return blake3.blake3(file_content).hexdigest(length=16)
+    return hashlib.blake2b(file_content, digest_size=16).hexdigest()
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_doc(doc_hash, _file_content=None):
+    """按指纹缓存已解析的文档，rerun 时不再重复 fitz.open
+    (_file_content 不参与缓存 key，只在首次打开时需要)"""
+    if _file_content is None:
+        # 文档已被挤出缓存，而调用方手里没有上传内容可以重新打开
+        raise RuntimeError("文档缓存已失效，请重新上传 PDF")
+    # 上传内容本来就由 uploaded_file 持有，直接从内存打开，不在磁盘上另留一份
+    # 不额外持有引用：缓存淘汰后文档随之回收，MuPDF 占用的资源一并释放
+    return fitz.open(stream=_file_content, filetype="pdf")
+
+def is_grayscale(page, clip=None, zoom=0.2, tolerance=8):
+    """用低分辨率探测图判断区域是否近乎无彩色 (各通道差不超过 tolerance)"""
+    probe = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+    arr = np.frombuffer(probe.samples_mv, dtype=np.uint8).reshape(-1, probe.n)
+    return int((arr.max(axis=1) - arr.min(axis=1)).max(initial=0)) <= tolerance
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def render_display_bg(doc_hash, page_num, zoom=DISPLAY_ZOOM):
     """缓存页面渲染，防止滚动时卡顿"""
-    doc = fitz.open(stream=file_content, filetype="pdf")
-    page = doc[page_num]
-    mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat, alpha=False)
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
+    page = get_doc(doc_hash)[page_num]
+    mat = DISPLAY_MAT if zoom == DISPLAY_ZOOM else fitz.Matrix(zoom, zoom)
+    # 纯黑白文字页按灰度渲染，像素只有 RGB 的三分之一
+    gray = is_grayscale(page)
+    pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY if gray else fitz.csRGB, alpha=False)
+    # 直接用原始像素构造，省掉 PNG 编码再解码的往返
+    img = Image.frombytes("L" if gray else "RGB", (pix.width, pix.height), pix.samples)
     return img
 
-def process_extraction(file_content, page_num, rect_dict, dpi_scale=8.33):
+def overlaps(rects, rect):
+    """rects 为 (N, 4) 的外框数组，返回与 rect 有重叠面积的布尔掩码"""
+    return ((np.minimum(rects[:, 2], rect.x1) > np.maximum(rects[:, 0], rect.x0))
+            & (np.minimum(rects[:, 3], rect.y1) > np.maximum(rects[:, 1], rect.y0)))
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def page_image_scales(doc_hash, page_num, min_pixels=400):
+    """每页位图的外框 (N, 4) 及原始分辨率对应的缩放倍率 (N,)，同一页多次提取时只解析一次"""
+    bboxes, scales = [], []
+    for info in get_doc(doc_hash)[page_num].get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        # 图标、二维码之类的小图不会是要提取的主体，不参与倍率判断
+        if bbox.is_empty or info["width"] * info["height"] < min_pixels:
+            continue
+        bboxes.append(tuple(bbox))
+        # 位图像素数 / 页面上占的点数 = 原始分辨率对应的缩放倍率
+        scales.append(max(info["width"] / bbox.width, info["height"] / bbox.height))
+    return np.array(bboxes, dtype=np.float32).reshape(-1, 4), np.array(scales, dtype=np.float32)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def page_drawing_rects(doc_hash, page_num):
+    """每页矢量路径的外框 (N, 4)，同一页多次提取时只解析一次"""
+    # get_cdrawings 直接返回 C 层的元组，不为每条路径构造 Rect / Point 对象
+    rects = [path["rect"] for path in get_doc(doc_hash)[page_num].get_cdrawings()]
+    return np.array(rects, dtype=np.float32).reshape(-1, 4)
+
+def is_bitmap_only(doc_hash, page_num, rect_pdf):
+    """选区内有位图且没有任何矢量路径 (扫描件、照片)"""
+    bboxes, _ = page_image_scales(doc_hash, page_num)
+    return bool(overlaps(bboxes, rect_pdf).any()
+                and not overlaps(page_drawing_rects(doc_hash, page_num), rect_pdf).any())
+
+def pick_dpi_scale(doc_hash, page_num, rect_pdf, max_scale=HD_SCALE, min_scale=MIN_EXTRACT_SCALE):
+    """选区内只有位图时按位图原始分辨率渲染，含矢量内容才用最高倍率 (约 600 DPI)"""
+    # 位图与矢量图混排时仍按矢量内容的需要渲染
+    if not is_bitmap_only(doc_hash, page_num, rect_pdf):
+        return max_scale
+    bboxes, scales = page_image_scales(doc_hash, page_num)
+    native_scales = scales[overlaps(bboxes, rect_pdf)]
+    # 留 20% 余量，且不低于最低提取倍率
+    return max(min_scale, min(max_scale, float(native_scales.max()) * 1.2))
+
+def caption_top(doc_hash, page_num, rect_pdf, words):
+    """选区底部标题行的上沿 y；只有这些文字下方再没有任何位图或矢量图形时才算标题，
+    图中的数值、刻度标签下面还有图形，不会被当作标题裁掉。识别不出时返回 None"""
+    image_rects, _ = page_image_scales(doc_hash, page_num)
+    graphics = np.concatenate([image_rects, page_drawing_rects(doc_hash, page_num)])
+    graphics = graphics[overlaps(graphics, rect_pdf)]
+    if not len(graphics):
+        return None
+    graphics_bottom = min(rect_pdf.y1, float(graphics[:, 3].max()))
+    below = [w[1] for w in words if w[1] >= graphics_bottom]
+    return min(below) if below else None
+
+def process_extraction(doc_hash, page_num, rect_dict, dpi_scale=None, max_scale=HD_SCALE, out_dir=None):
     """处理提取：OCR识别 -> 涂白 -> 裁剪"""
-    doc = fitz.open(stream=file_content, filetype="pdf")
-    page = doc[page_num]
+    page = get_doc(doc_hash)[page_num]
     
-    # 还原坐标 (Canvas 2倍缩放 -> PDF 坐标)
-    scale = 0.5 # 因为显示是用2倍缩放的
+    # 还原坐标 (Canvas 按显示倍率缩放 -> PDF 坐标)
+    scale = 1 / DISPLAY_ZOOM
     r_x = rect_dict["left"] * scale
     r_y = rect_dict["top"] * scale
     r_w = rect_dict["width"] * scale
     r_h = rect_dict["height"] * scale
     rect_pdf = fitz.Rect(r_x, r_y, r_x + r_w, r_y + r_h)
     
-    # 1. 提取文字
-    text_dict = page.get_text("dict", clip=rect_pdf)
-    extracted_text_parts = []
-    text_blocks_rects = []
-    
-    for block in text_dict.get("blocks", []):
-        for line in block.get("lines", []):
-            for span in line.get("spans", []):
-                text = span["text"].strip()
-                if text:
-                    extracted_text_parts.append(text)
-                    text_blocks_rects.append(span["bbox"])
+    # 1. 提取文字 ("words" 模式直接返回扁平的 (x0, y0, x1, y1, text, ...) 元组，按阅读顺序排好)
+    words = page.get_text("words", clip=rect_pdf, flags=WORD_FLAGS, sort=True)
+    extracted_text_parts = [w[4] for w in words]
     
     full_caption = " ".join(extracted_text_parts)
     if not full_caption:
         full_caption = f"Page_{page_num+1}_Image"
+    
+    # 能确认底部标题时，高清渲染只到标题上沿，少渲染一截像素，标题行也不用再涂白；
+    # 否则按整个选区渲染，文字照常涂白
+    figure_rect = rect_pdf
+    cut_y = caption_top(doc_hash, page_num, rect_pdf, words)
+    if cut_y is not None:
+        figure_rect = fitz.Rect(rect_pdf.x0, rect_pdf.y0, rect_pdf.x1, cut_y)
+    text_blocks_rects = [w[:4] for w in words if w[1] < figure_rect.y1]
         
     # 2. 高清截图
-    mat = fitz.Matrix(dpi_scale, dpi_scale)
-    pix = page.get_pixmap(matrix=mat, clip=rect_pdf, alpha=False)
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
-    
-    # 3. 涂白文字
-    draw = ImageDraw.Draw(img)
-    offset_x = rect_pdf.x0
-    offset_y = rect_pdf.y0
-    
-    for bbox in text_blocks_rects:
-        x0 = (bbox[0] - offset_x) * dpi_scale
-        y0 = (bbox[1] - offset_y) * dpi_scale
-        x1 = (bbox[2] - offset_x) * dpi_scale
-        y1 = (bbox[3] - offset_y) * dpi_scale
-        draw.rectangle([x0-2, y0-2, x1+2, y1+2], fill="white")
+    if dpi_scale is None:
+        dpi_scale = pick_dpi_scale(doc_hash, page_num, figure_rect, max_scale=max_scale)
+    mat = HD_MAT if dpi_scale == HD_SCALE else fitz.Matrix(dpi_scale, dpi_scale)
+    # 选区没有颜色时直接渲染灰度图，高清像素缓冲区小三倍
+    colorspace = fitz.csGRAY if is_grayscale(page, figure_rect, zoom=1) else fitz.csRGB
+    pix = page.get_pixmap(matrix=mat, clip=figure_rect, colorspace=colorspace, alpha=False)
+    try:
+        # 涂白、修剪都直接在 pixmap 的像素缓冲区上做，最后只构造一次 PIL 图像
+        shape = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+        arr = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(shape)
         
-    # 4. 自动修剪
-    final_img = trim_white_borders(img)
+        # 3. 涂白文字 (一次换算全部坐标，直接对像素数组切片赋值)
+        if text_blocks_rects:
+            offset = np.array([figure_rect.x0, figure_rect.y0, figure_rect.x0, figure_rect.y0])
+            coords = (np.asarray(text_blocks_rects) - offset) * dpi_scale
+            coords[:, :2] = np.floor(coords[:, :2]) - 2
+            coords[:, 2:] = np.ceil(coords[:, 2:]) + 3
+            for x0, y0, x1, y1 in np.clip(coords, 0, None).astype(np.int32):
+                arr[y0:y1, x0:x1] = 255
+            
+        # 4. 自动修剪
+        final_img = Image.fromarray(trim_white_borders(arr))
+        width, height = final_img.size
+        photo = is_bitmap_only(doc_hash, page_num, figure_rect)
+        img_path = save_extracted_image(final_img, out_dir, photo=photo)
+    finally:
+        # 高清 pixmap 可能上百 MB，写盘后立即释放 (出错时也不让 traceback 一直留着它)；
+        # 高清渲染还会把解码后的大图留在 MuPDF 的资源缓存里，一并清掉
+        final_img = arr = pix = None
+        fitz.TOOLS.store_shrink(100)
     
-    out_io = io.BytesIO()
-    final_img.save(out_io, format="PNG")
+    return img_path, full_caption, width, height
+
+def save_extracted_image(img, out_dir=None, photo=False, photo_colors=2000):
+    """结果只编码一次写入临时文件，导出时 PPT / ZIP 直接按路径读取"""
+    # 只有纯位图选区 (照片、扫描件) 且颜色很多时才用 JPEG；
+    # 矢量线条、图表的抗锯齿边缘同样会产生大量颜色，但必须保持无损 PNG
+    if photo and img.getcolors(maxcolors=photo_colors) is None:
+        with NamedTemporaryFile(delete=False, suffix=".jpg", prefix="pdf_extract_", dir=out_dir) as tmp:
+            img.save(tmp, format="JPEG", quality=90, subsampling=1)
+        return tmp.name
+    if img.mode == "RGB" and img.getcolors(maxcolors=256) is not None:
+        # 不超过 256 色时转调色板图是无损的 (中位切分会原样保留这些颜色)，体积小得多
+        img = img.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    with NamedTemporaryFile(delete=False, suffix=".png", prefix="pdf_extract_", dir=out_dir) as tmp:
+        # 会话内的临时结果，用最快的压缩级别即可
+        img.save(tmp, format="PNG", compress_level=1, optimize=False)
+    return tmp.name
+
+def discard_extracted_images(items):
+    for item in items:
+        remove_quietly(item["path"])
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_pptx(items_sig):
+    """按提取列表的签名缓存导出结果，列表不变时 rerun 直接复用"""
+    # python-pptx 导入较慢 (lxml + schema)，只在真正导出时才加载
+    from pptx import Presentation
+    from pptx.util import Inches, Pt
+    from pptx.enum.text import PP_ALIGN
+
+    prs = Presentation()
+    # 默认 3:4
+    prs.slide_width = Inches(7.5); prs.slide_height = Inches(10)
     
-    return out_io.getvalue(), full_caption, final_img.width, final_img.height
+    for path, name, w, h in items_sig:
+        slide = prs.slides.add_slide(prs.slide_layouts[6])
+        pw, ph = prs.slide_width, prs.slide_height
+        margin = Inches(0.5)
+        
+        # 布局计算
+        max_h = ph - Inches(1.5)
+        max_w = pw - margin * 2
+        ratio = w / h
+        target_w = max_w
+        target_h = target_w / ratio
+        if target_h > max_h:
+            target_h = max_h
+            target_w = target_h * ratio
+        
+        left = (pw - target_w) / 2
+        top = Inches(0.5)
+        
+        slide.shapes.add_picture(path, left, top, width=target_w, height=target_h)
+        
+        tb = slide.shapes.add_textbox(margin, top + target_h + Inches(0.1), pw - margin*2, Inches(1))
+        p = tb.text_frame.add_paragraph()
+        p.text = name
+        p.alignment = PP_ALIGN.CENTER
+        p.font.bold = True
+        p.font.size = Pt(14)
+        p.font.name = "Microsoft YaHei"
+        
+    # download_button 总要拿到完整的 bytes，中间落盘不会降低峰值内存
+    ppt_io = io.BytesIO()
+    prs.save(ppt_io)
+    return ppt_io.getvalue()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_zip(items_sig):
+    import zipfile
+
+    zip_io = io.BytesIO()
+    # PNG / JPEG 本身已经压缩过，直接存储即可
+    with zipfile.ZipFile(zip_io, "w", zipfile.ZIP_STORED) as zf:
+        for i, (path, name, _, _) in enumerate(items_sig):
+            zf.write(path, arcname=f"{i+1}_{name}{os.path.splitext(path)[1]}")
+    return zip_io.getvalue()
+
+def request_export(kind, items_sig):
+    st.session_state[f"{kind}_sig"] = items_sig
 
 # ==========================================
 # 3. 界面逻辑
@@ -114,6 +346,10 @@ def process_extraction(file_content, page_num, rect_dict, dpi_scale=8.33):
 # 状态初始化
 if 'extracted_list' not in st.session_state:
     st.session_state.extracted_list = []
+if 'extract_dir' not in st.session_state:
+    # 提取结果放在本会话专属的临时目录里：会话结束、session_state 被回收时
+    # TemporaryDirectory 会连同目录一起删除，程序退出时也会清理
+    st.session_state.extract_dir = TemporaryDirectory(prefix="pdf_extract_")
 
 # --- 侧边栏 ---
 with st.sidebar:
@@ -123,11 +359,18 @@ with st.sidebar:
     # 如果文件太大，允许用户限制显示的页数，避免卡顿
     display_range = None
     if uploaded_file:
-        doc_temp = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-        total_pages = len(doc_temp)
+        bytes_data = uploaded_file.getvalue()
+        # 同一个上传文件只计算一次指纹，之后的 rerun 直接复用
+        if st.session_state.get("doc_file_id") != uploaded_file.file_id:
+            st.session_state.doc_file_id = uploaded_file.file_id
+            st.session_state.doc_hash = file_fingerprint(bytes_data)
+        doc_hash = st.session_state.doc_hash
+        total_pages = len(get_doc(doc_hash, bytes_data))
         if total_pages > 5:
             st.info(f"文档共 {total_pages} 页")
             display_range = st.slider("显示页码范围 (防止卡顿)", 1, total_pages, (1, min(10, total_pages)))
+    # 幻灯片上 300 DPI 已足够清晰，需要印刷大图时再调高 (最高约 600 DPI)
+    output_dpi = st.slider("输出DPI", 150, 600, 300, step=50)
     
     st.divider()
     st.header("3. 导出结果")
@@ -142,68 +385,102 @@ with st.sidebar:
                     st.caption(f"{idx+1}. {item['name']}")
     
     if st.button("🗑️ 清空所有"):
+        discard_extracted_images(st.session_state.extracted_list)
         st.session_state.extracted_list = []
+        for key in [k for k in st.session_state if k.startswith("last_obj_")]:
+            del st.session_state[key]
         st.rerun()
 
     # 导出按钮
     if st.session_state.extracted_list:
+        items_sig = tuple((item["path"], item["name"], item["w"], item["h"])
+                          for item in st.session_state.extracted_list)
         c1, c2 = st.columns(2)
+        # 点了生成才打包：只要 ZIP 的不必付 python-pptx 的开销；列表变化后需重新生成
+        if st.session_state.get("pptx_sig") == items_sig:
+            c1.download_button("📥 PPTX", build_pptx(items_sig), "export.pptx")
+        else:
+            c1.button("⚙️ 生成 PPTX", on_click=request_export, args=("pptx", items_sig))
+        if st.session_state.get("zip_sig") == items_sig:
+            c2.download_button("📦 ZIP", build_zip(items_sig), "images.zip")
+        else:
+            c2.button("⚙️ 生成 ZIP", on_click=request_export, args=("zip", items_sig))
+
+# 每页是一个 fragment：在画布上画框、开关本页只重跑这一页，不会把整条瀑布流重新渲染一遍
+@st.fragment
+def render_page(doc_hash, file_bytes, p_idx, default_open, output_dpi):
+    from streamlit_drawable_canvas import st_canvas
+
+    # fragment 重跑时不经过侧边栏；文档可能已被其他会话挤出全局缓存，先按原始内容补回
+    get_doc(doc_hash, file_bytes)
+
+    st.divider()
+    st.markdown(f"### 第 {p_idx + 1} 页")
+    # 只渲染打开的页面，默认打开范围内的前 3 页
+    # (st.expander 折叠时内部代码照样执行，起不到按需渲染的作用)
+    if not st.toggle("显示本页", value=default_open, key=f"show_page_{p_idx}"):
+        return
+    
+    # 1. 获取背景图 (带缓存，速度快)
+    bg_image = render_display_bg(doc_hash, p_idx)
+    
+    # 2. 创建画布
+    # key 必须唯一，使用页码区分
+    canvas_result = st_canvas(
+        fill_color="rgba(255, 0, 0, 0.1)",
+        stroke_width=2,
+        stroke_color="#FF0000",
+        background_image=bg_image,
+        update_streamlit=True,
+        height=bg_image.height,
+        width=bg_image.width,
+        drawing_mode="rect",
+        key=f"canvas_page_{p_idx}", # 关键：每页独立的 ID
+        display_toolbar=True,
+    )
+    
+    # 3. 提取按钮 (跟随在每一页下面)
+    # 检查当前页是否有新画的框
+    if canvas_result.json_data and canvas_result.json_data["objects"]:
+        last_obj = canvas_result.json_data["objects"][-1]
+        obj_key = f"last_obj_{doc_hash}_{p_idx}"
+        # 换了输出 DPI 时允许同一个框重新提取
+        obj_state = (last_obj, output_dpi)
         
-        # PPTX
-        prs = Presentation()
-        # 默认 3:4
-        prs.slide_width = Inches(7.5); prs.slide_height = Inches(10)
-        
-        for item in st.session_state.extracted_list:
-            slide = prs.slides.add_slide(prs.slide_layouts[6])
-            pw, ph = prs.slide_width, prs.slide_height
-            margin = Inches(0.5)
-            
-            img_io = io.BytesIO(item["bytes"])
-            
-            # 布局计算
-            max_h = ph - Inches(1.5)
-            max_w = pw - margin * 2
-            ratio = item["w"] / item["h"]
-            target_w = max_w
-            target_h = target_w / ratio
-            if target_h > max_h:
-                target_h = max_h
-                target_w = target_h * ratio
-            
-            left = (pw - target_w) / 2
-            top = Inches(0.5)
-            
-            slide.shapes.add_picture(img_io, left, top, width=target_w, height=target_h)
-            
-            tb = slide.shapes.add_textbox(margin, top + target_h + Inches(0.1), pw - margin*2, Inches(1))
-            p = tb.text_frame.add_paragraph()
-            p.text = item["name"]
-            p.alignment = PP_ALIGN.CENTER
-            p.font.bold = True
-            p.font.size = Pt(14)
-            p.font.name = "Microsoft YaHei"
-            
-        ppt_io = io.BytesIO()
-        prs.save(ppt_io); ppt_io.seek(0)
-        c1.download_button("📥 PPTX", ppt_io, "export.pptx")
-        
-        # ZIP
-        zip_io = io.BytesIO()
-        with zipfile.ZipFile(zip_io, "w", zipfile.ZIP_DEFLATED) as zf:
-            for i, item in enumerate(st.session_state.extracted_list):
-                zf.writestr(f"{i+1}_{item['name']}.png", item["bytes"])
-        zip_io.seek(0)
-        c2.download_button("📦 ZIP", zip_io, "images.zip")
+        col_btn, col_msg = st.columns([1, 4])
+        # 这个框刚提取过就不再显示按钮，免得重复做高清渲染
+        if st.session_state.get(obj_key) == obj_state:
+            with col_msg:
+                st.caption("✅ 该区域已提取，画新的框可继续提取")
+            return
+        with col_btn:
+            # 按钮 key 也必须唯一
+            if st.button(f"⚡ 提取第 {p_idx+1} 页选中区域", key=f"btn_{p_idx}", type="primary"):
+                try:
+                    img_path, img_name, w, h = process_extraction(
+                        doc_hash, p_idx, last_obj, max_scale=min(HD_SCALE, output_dpi / 72),
+                        out_dir=st.session_state.extract_dir.name)
+                    st.session_state[obj_key] = obj_state
+                    
+                    st.session_state.extracted_list.append({
+                        "path": img_path,
+                        "name": sanitize_filename(img_name),
+                        "page": p_idx + 1,
+                        "w": w, "h": h
+                    })
+                    st.success(f"已提取: {img_name}")
+                    # 提取成功后整页重跑一次，刷新侧边栏的列表和计数
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"提取出错: {e}")
+        with col_msg:
+            st.caption("✅ 已选中区域，点击左侧按钮提取")
 
 # --- 主界面：瀑布流显示 ---
 st.title("📜 浏览模式提取工具")
 st.info("操作方式：像看书一样往下滑，看到想提取的图，直接**画框**，然后点下方的**⚡提取**按钮。")
 
 if uploaded_file:
-    # 读取文件流
-    bytes_data = uploaded_file.getvalue()
-    
     # 确定显示范围
     start_p = 0
     end_p = total_pages
@@ -213,52 +490,7 @@ if uploaded_file:
     
     # === 循环渲染每一页 ===
     for p_idx in range(start_p, end_p):
-        st.divider()
-        st.markdown(f"### 第 {p_idx + 1} 页")
-        
-        # 1. 获取背景图 (带缓存，速度快)
-        bg_image = get_page_image(bytes_data, p_idx)
-        
-        # 2. 创建画布
-        # key 必须唯一，使用页码区分
-        canvas_result = st_canvas(
-            fill_color="rgba(255, 0, 0, 0.1)",
-            stroke_width=2,
-            stroke_color="#FF0000",
-            background_image=bg_image,
-            update_streamlit=True,
-            height=bg_image.height,
-            width=bg_image.width,
-            drawing_mode="rect",
-            key=f"canvas_page_{p_idx}", # 关键：每页独立的 ID
-            display_toolbar=True,
-        )
-        
-        # 3. 提取按钮 (跟随在每一页下面)
-        # 检查当前页是否有新画的框
-        if canvas_result.json_data and canvas_result.json_data["objects"]:
-            last_obj = canvas_result.json_data["objects"][-1]
-            
-            col_btn, col_msg = st.columns([1, 4])
-            with col_btn:
-                # 按钮 key 也必须唯一
-                if st.button(f"⚡ 提取第 {p_idx+1} 页选中区域", key=f"btn_{p_idx}", type="primary"):
-                    try:
-                        img_bytes, img_name, w, h = process_extraction(bytes_data, p_idx, last_obj)
-                        
-                        st.session_state.extracted_list.append({
-                            "bytes": img_bytes,
-                            "name": sanitize_filename(img_name),
-                            "page": p_idx + 1,
-                            "w": w, "h": h
-                        })
-                        st.success(f"已提取: {img_name}")
-                        # 强制刷新侧边栏
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"提取出错: {e}")
-            with col_msg:
-                st.caption("✅ 已选中区域，点击左侧按钮提取")
+        render_page(doc_hash, bytes_data, p_idx, default_open=p_idx < start_p + 3, output_dpi=output_dpi)
 
 else:
     st.warning("请在左侧上传 PDF 文件。")